@@ -0,0 +1,127 @@
+"""
+Tracking of processing blocks stuck in transient states.
+"""
+import heapq
+import json
+import os
+import time
+
+# Statuses which a processing block is expected to leave within a timeout
+TRANSIENT_STATUSES = frozenset(["STARTING"])
+
+# Default timeout (in seconds) for leaving a transient status
+PB_TIMEOUT = float(os.getenv("SDP_PROCCONTROL_PB_TIMEOUT", "600"))
+
+# Timeouts per workflow type, as a JSON object, e.g. {"batch": 1200}
+PB_TIMEOUTS = os.getenv("SDP_PROCCONTROL_PB_TIMEOUTS")
+
+
+class DeadlineTracker:
+    """
+    Tracker of processing blocks in transient states.
+
+    Each processing block is given a deadline for leaving its current
+    transient status, depending on the workflow type. The deadlines are kept
+    in a heap, so finding the expired ones takes O(log n) per processing
+    block, without scanning all of them. Processing blocks which leave the
+    transient status are removed lazily: their heap entries are skipped when
+    they reach the top.
+
+    Deadlines are not persisted, so after a restart they start again from
+    when the processing block is first seen.
+
+    :param default_timeout: timeout for workflow types not in timeouts
+    :param timeouts: dict of timeouts per workflow type, if None they are
+        read from the environment
+    :param clock: function returning the current time in seconds
+
+    """
+
+    def __init__(self, default_timeout=PB_TIMEOUT, timeouts=None, clock=time.monotonic):
+        if timeouts is None:
+            timeouts = {} if PB_TIMEOUTS is None else json.loads(PB_TIMEOUTS)
+        self._default_timeout = default_timeout
+        self._timeouts = timeouts
+        self._clock = clock
+        # Heap of (deadline, pb_id, status)
+        self._heap = []
+        # Current (status, deadline) of each tracked processing block
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, pb_id):
+        return pb_id in self._entries
+
+    def timeout(self, wf_type):
+        """
+        Get the timeout for a workflow type.
+
+        :param wf_type: workflow type
+        :returns: timeout in seconds
+
+        """
+        return self._timeouts.get(wf_type, self._default_timeout)
+
+    def update(self, pb_id, status, wf_type):
+        """
+        Update the status of a processing block.
+
+        The processing block is tracked if the status is transient, otherwise
+        it is no longer tracked. The deadline is only set when the processing
+        block enters a transient status.
+
+        :param pb_id: processing block ID
+        :param status: processing block status
+        :param wf_type: workflow type
+
+        """
+        if status not in TRANSIENT_STATUSES:
+            self.discard(pb_id)
+            return
+
+        entry = self._entries.get(pb_id)
+        if entry is not None and entry[0] == status:
+            return
+
+        deadline = self._clock() + self.timeout(wf_type)
+        self._entries[pb_id] = (status, deadline)
+        heapq.heappush(self._heap, (deadline, pb_id, status))
+        self._compact()
+
+    def discard(self, pb_id):
+        """
+        Stop tracking a processing block.
+
+        :param pb_id: processing block ID
+
+        """
+        self._entries.pop(pb_id, None)
+
+    def expired(self):
+        """
+        Get the processing blocks whose deadlines have expired.
+
+        The processing blocks are no longer tracked once they are returned.
+
+        :returns: list of (processing block ID, status) tuples
+
+        """
+        now = self._clock()
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, pb_id, status = heapq.heappop(self._heap)
+            if self._entries.get(pb_id) == (status, deadline):
+                del self._entries[pb_id]
+                expired.append((pb_id, status))
+        return expired
+
+    def _compact(self):
+        """Rebuild the heap if it is mostly made of stale entries."""
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [
+                (deadline, pb_id, status)
+                for pb_id, (status, deadline) in self._entries.items()
+            ]
+            heapq.heapify(self._heap)
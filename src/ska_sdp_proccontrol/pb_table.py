@@ -0,0 +1,161 @@
+"""
+Compact in-memory table of processing block states.
+"""
+import sys
+
+# Statuses from which a processing block never changes
+TERMINAL_STATUSES = frozenset(["FINISHED", "FAILED"])
+
+
+class PBRecord:
+    """
+    Record of a processing block in the table.
+
+    Only the fields used by the processing controller are kept. The IDs are
+    interned so records referring to the same processing block or deployment
+    share a single string.
+
+    :param pb_id: processing block ID
+    :param dependencies: IDs of processing blocks this one depends on
+
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    __slots__ = ("pb_id", "status", "resources_available", "dependencies", "deploy_ids")
+
+    def __init__(self, pb_id, dependencies=()):
+        self.pb_id = pb_id
+        self.status = None
+        self.resources_available = None
+        self.dependencies = tuple(sys.intern(dep) for dep in dependencies)
+        self.deploy_ids = ()
+
+    def __repr__(self):
+        return "PBRecord({!r}, status={!r}, resources_available={!r})".format(
+            self.pb_id, self.status, self.resources_available
+        )
+
+    @property
+    def terminal(self):
+        """True if the processing block is in a terminal state."""
+        return self.status in TERMINAL_STATUSES
+
+
+class PBTable:
+    """
+    Table of processing block records keyed by interned processing block ID.
+
+    Records are updated in place. Records of processing blocks which are no
+    longer in the config DB are dropped by :meth:`retain`, so the memory use
+    depends only on the number of current processing blocks, not on how many
+    have been seen since the controller started.
+    """
+
+    def __init__(self):
+        self._records = {}
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, pb_id):
+        return pb_id in self._records
+
+    def __iter__(self):
+        return iter(self._records.values())
+
+    def get(self, pb_id):
+        """
+        Get the record of a processing block.
+
+        :param pb_id: processing block ID
+        :returns: record, or None if the processing block is not in the table
+
+        """
+        return self._records.get(pb_id)
+
+    def add(self, pb_id, dependencies=()):
+        """
+        Add a processing block to the table if it is not already present.
+
+        :param pb_id: processing block ID
+        :param dependencies: IDs of processing blocks this one depends on
+        :returns: record of the processing block
+
+        """
+        record = self._records.get(pb_id)
+        if record is None:
+            pb_id = sys.intern(pb_id)
+            record = PBRecord(pb_id, dependencies)
+            self._records[pb_id] = record
+        return record
+
+    def update(self, pb_id, state):
+        """
+        Update the state of a processing block.
+
+        :param pb_id: processing block ID
+        :param state: processing block state, or None if it does not exist
+        :returns: record of the processing block
+
+        """
+        record = self.add(pb_id)
+        if state is None:
+            record.status = None
+            record.resources_available = None
+        else:
+            status = state.get("status")
+            record.status = None if status is None else sys.intern(status)
+            record.resources_available = state.get("resources_available")
+        return record
+
+    def set_deployments(self, pb_id, deploy_ids):
+        """
+        Set the deployments associated with a processing block.
+
+        :param pb_id: processing block ID
+        :param deploy_ids: list of deployment IDs
+
+        """
+        record = self._records.get(pb_id)
+        if record is not None:
+            record.deploy_ids = tuple(sys.intern(d) for d in deploy_ids)
+
+    def status(self, pb_id):
+        """
+        Get the status of a processing block.
+
+        :param pb_id: processing block ID
+        :returns: status, or None if not known
+
+        """
+        record = self._records.get(pb_id)
+        return None if record is None else record.status
+
+    def is_terminal(self, pb_id):
+        """
+        Check if a processing block is in a terminal state.
+
+        :param pb_id: processing block ID
+        :returns: True if the status is known to be terminal
+
+        """
+        record = self._records.get(pb_id)
+        return record is not None and record.terminal
+
+    def retain(self, pb_ids):
+        """
+        Drop the records of processing blocks not in the list.
+
+        :param pb_ids: list of processing block IDs to keep
+
+        """
+        keep = set(pb_ids)
+        if any(pb_id not in keep for pb_id in self._records):
+            # Rebuild the dict rather than deleting entries, since a dict
+            # never shrinks its storage when entries are removed
+            self._records = {
+                pb_id: record
+                for pb_id, record in self._records.items()
+                if pb_id in keep
+            }
@@ -3,15 +3,30 @@ Main processing controller class which contains the event loop.
 """
 import logging
 import os
+import queue
 import re
 import signal
 import sys
+import threading
 
 import ska_sdp_config
 from ska_ser_logging import configure_logging
 
+from .deadlines import DeadlineTracker
+from .pb_table import PBTable
+from .target import Target, load_targets
+from .watchdog import Watchdog
+
 LOG_LEVEL = os.getenv("SDP_LOG_LEVEL", "DEBUG")
 
+# Timeout (in seconds) for waiting for changes in the config DB. The main loop
+# makes a pass at least this often, so the watchdog can detect stalls.
+LOOP_TIMEOUT = float(os.getenv("SDP_PROCCONTROL_LOOP_TIMEOUT", "60"))
+
+# Maximum number of deployments of timed out processing blocks deleted in each
+# pass of the main loop
+DELETE_BATCH = int(os.getenv("SDP_PROCCONTROL_DELETE_BATCH", "10"))
+
 LOG = logging.getLogger(__name__)
 
 # Regular expression to match processing block ID as substring
@@ -21,6 +36,10 @@ _RE_PB = "pb(-[0-9a-zA-Z]*){3}"
 # a processing block
 _RE_DEPLOY_PROC_ANY = re.compile("^proc-(?P<pb_id>{}).*$".format(_RE_PB))
 
+# Compiled regular expression to match the reason given to processing blocks
+# failed by the controller when they time out
+_RE_REASON_TIMED_OUT = re.compile("^Timed out in .* status$")
+
 
 class ProcessingController:
     """
@@ -28,9 +47,37 @@ class ProcessingController:
     """
 
     # pylint: disable=invalid-name, too-few-public-methods
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, target=None, watchdog=None):
+        """
+        Initialise the processing controller.
 
-    def __init__(self):
-        pass
+        :param target: config DB target, if None the default target is used
+        :param watchdog: watchdog for the main loop, if None one is created
+
+        """
+        if target is None:
+            target = Target()
+        if watchdog is None:
+            watchdog = Watchdog()
+        self._target = target
+        self._watchdog = watchdog
+        self._monitor = watchdog.monitor(target.name)
+        self._pb_table = PBTable()
+        self._deadlines = DeadlineTracker()
+        # Processing blocks timed out by the controller whose deployments
+        # have not all been deleted yet
+        self._cleanup_pb_ids = set()
+        # Processing blocks which had deployments in the last pass
+        self._pbs_with_deployments = set()
+        self.metrics = {
+            "passes": 0,
+            "workflows_started": 0,
+            "pbs_released": 0,
+            "pbs_timed_out": 0,
+            "deployments_deleted": 0,
+        }
 
     @staticmethod
     def _get_pb_status(txn, pb_id: str) -> str:
@@ -57,21 +104,42 @@ class ProcessingController:
         :param pb_ids: list of processing block ids
         """
         for pb_id in pb_ids:
+            # Terminal states never change, so there is no need to read them
+            if self._pb_table.is_terminal(pb_id):
+                continue
+
+            started = False
             for txn in watcher.txn():
-                if txn.get_processing_block(pb_id) is None:
+                started = False
+                pb = txn.get_processing_block(pb_id)
+                if pb is None:
                     continue
+                if pb_id not in self._pb_table:
+                    deps = [dep["pb_id"] for dep in pb.dependencies]
+                    self._pb_table.add(pb_id, deps)
 
                 state = txn.get_processing_block_state(pb_id)
                 if state is None:
-                    self._start_workflow(txn, pb_id)
-
-    @staticmethod
-    def _start_workflow(txn, pb_id):
+                    state = self._start_workflow(txn, pb_id)
+                    started = state["status"] == "STARTING"
+                record = self._pb_table.update(pb_id, state)
+                self._deadlines.update(pb_id, record.status, pb.workflow["type"])
+                # Rebuilds the processing blocks to clean up after a restart
+                if record.status == "FAILED" and _RE_REASON_TIMED_OUT.match(
+                    state.get("reason") or ""
+                ):
+                    self._cleanup_pb_ids.add(record.pb_id)
+            # Counted after the loop, since the transaction may be retried
+            if started:
+                self.metrics["workflows_started"] += 1
+
+    def _start_workflow(self, txn, pb_id):
         """
         Start the workflow for a processing block.
 
         :param txn: config DB transaction
         :param pb_id: processing block ID
+        :returns: processing block state
 
         """
         LOG.info("Making deployment for processing block %s", pb_id)
@@ -97,9 +165,7 @@ class ProcessingController:
             LOG.info("Deploying %s", wf_description)
             deploy_id = "proc-{}-workflow".format(pb_id)
             values = {}
-            values["env"] = {}
-            for v in ["SDP_CONFIG_HOST", "SDP_HELM_NAMESPACE"]:
-                values["env"][v] = os.environ[v]
+            values["env"] = self._target.workflow_env()
             values["wf_image"] = wf_image
             values["pb_id"] = pb_id
             chart = {"chart": "workflow", "values": values}
@@ -113,6 +179,7 @@ class ProcessingController:
 
         # Create the processing block state.
         txn.create_processing_block_state(pb_id, state)
+        return state
 
     def _release_pbs_with_finished_dependencies(self, watcher, pb_ids):
         """
@@ -122,11 +189,21 @@ class ProcessingController:
         :param pb_ids: list of processing block ids
         """
         for pb_id in pb_ids:
+            record = self._pb_table.get(pb_id)
+            # Processing blocks which are terminal or already released never
+            # need to be released again, so there is no need to read them
+            if record is not None and (record.terminal or record.resources_available):
+                continue
             for txn in watcher.txn():
-                if txn.get_processing_block(pb_id) is None:
-                    continue
+                if record is None:
+                    pb = txn.get_processing_block(pb_id)
+                    if pb is None:
+                        continue
+                    deps = [dep["pb_id"] for dep in pb.dependencies]
+                    record = self._pb_table.add(pb_id, deps)
 
                 state = txn.get_processing_block_state(pb_id)
+                self._pb_table.update(pb_id, state)
                 if state is None:
                     status = None
                     ra = None
@@ -134,19 +211,107 @@ class ProcessingController:
                     status = state.get("status")
                     ra = state.get("resources_available")
                 if status == "WAITING" and not ra:
-                    # Check status of dependencies.
-                    pb = txn.get_processing_block(pb_id)
+                    # Check status of dependencies. FINISHED is a terminal
+                    # state, so it is only read if not already in the table.
                     dep_finished = all(
-                        self._get_pb_status(txn, dep["pb_id"]) == "FINISHED"
-                        for dep in pb.dependencies
+                        self._pb_table.status(dep_id) == "FINISHED"
+                        or self._get_pb_status(txn, dep_id) == "FINISHED"
+                        for dep_id in record.dependencies
                     )
                     if dep_finished:
                         LOG.info("Releasing processing block %s", pb_id)
                         state["resources_available"] = True
                         txn.update_processing_block_state(pb_id, state)
+                        self._pb_table.update(pb_id, state)
+                        self.metrics["pbs_released"] += 1
 
-    @staticmethod
-    def _delete_deployments_without_pb(watcher, pb_ids, deploy_ids):
+    def _fail_stuck_pbs(self, watcher):
+        """
+        Fail processing blocks which have been in a transient state for too
+        long.
+
+        :param watcher: config DB watcher object (Config.watcher())
+        """
+        for pb_id, status in self._deadlines.expired():
+            failed = False
+            for txn in watcher.txn():
+                state = txn.get_processing_block_state(pb_id)
+                # Check the status has not changed since it was last read
+                failed = state is not None and state.get("status") == status
+                if failed:
+                    LOG.warning(
+                        "Processing block %s timed out in %s status", pb_id, status
+                    )
+                    state["status"] = "FAILED"
+                    state["reason"] = "Timed out in {} status".format(status)
+                    txn.update_processing_block_state(pb_id, state)
+            if failed:
+                record = self._pb_table.update(pb_id, state)
+                self._cleanup_pb_ids.add(record.pb_id)
+                self.metrics["pbs_timed_out"] += 1
+
+    def _delete_timed_out_pb_deployments(self, watcher):
+        """
+        Delete a batch of the deployments of processing blocks timed out by
+        the controller.
+
+        Processing blocks are removed from the set to clean up once they no
+        longer have any deployments. At most DELETE_BATCH deployments are
+        deleted in a single transaction, the rest are left for subsequent
+        passes.
+
+        :param watcher: config DB watcher object (Config.watcher())
+        """
+        batch = []
+        done = []
+        for pb_id in self._cleanup_pb_ids:
+            if len(batch) >= DELETE_BATCH:
+                break
+            record = self._pb_table.get(pb_id)
+            if record is None or not record.deploy_ids:
+                done.append(pb_id)
+            else:
+                batch.extend(record.deploy_ids[: DELETE_BATCH - len(batch)])
+        self._cleanup_pb_ids.difference_update(done)
+        if not batch:
+            return
+
+        deleted = 0
+        for txn in watcher.txn():
+            deleted = 0
+            for deploy_id in batch:
+                deploy = txn.get_deployment(deploy_id)
+                if deploy is not None:
+                    LOG.info("Deleting deployment %s", deploy_id)
+                    txn.delete_deployment(deploy)
+                    deleted += 1
+        self.metrics["deployments_deleted"] += deleted
+
+    def _update_pb_table(self, pb_ids, deploy_ids):
+        """
+        Drop processing blocks no longer in the config DB from the table and
+        record the deployments associated with the remaining ones.
+
+        :param pb_ids: list of processing block ids
+        :param deploy_ids: list of deployment ids
+        """
+        self._pb_table.retain(pb_ids)
+        pb_deploy_ids = {}
+        for deploy_id in deploy_ids:
+            match = _RE_DEPLOY_PROC_ANY.match(deploy_id)
+            if match is not None:
+                pb_deploy_ids.setdefault(match.group("pb_id"), []).append(deploy_id)
+
+        # Only update the records whose deployments have changed
+        for pb_id, pb_deploys in pb_deploy_ids.items():
+            record = self._pb_table.get(pb_id)
+            if record is not None and record.deploy_ids != tuple(pb_deploys):
+                self._pb_table.set_deployments(pb_id, pb_deploys)
+        for pb_id in self._pbs_with_deployments.difference(pb_deploy_ids):
+            self._pb_table.set_deployments(pb_id, ())
+        self._pbs_with_deployments = set(pb_deploy_ids)
+
+    def _delete_deployments_without_pb(self, watcher, pb_ids, deploy_ids):
         """
         Delete processing deployments not associated with a processing block.
 
@@ -168,32 +333,105 @@ class ProcessingController:
                         LOG.info("Deleting deployment %s", deploy_id)
                         deploy = txn.get_deployment(deploy_id)
                         txn.delete_deployment(deploy)
+                        self.metrics["deployments_deleted"] += 1
 
     def main_loop(self, backend=None):
         """
         Main event loop, executing three processes on a transaction,
         performing actions depending on the transaction state.
 
-        :param backend: config DB backend to use
+        :param backend: config DB backend to use, overrides the target backend
 
         """
+        if backend is not None:
+            # Also used by the workflows, so it is set on the target
+            self._target.backend = backend
+        name = self._target.name
+        config_args = self._target.config_args()
+
         # Connect to config DB
-        LOG.info("Connecting to config DB")
-        config = ska_sdp_config.Config(backend=backend)
+        LOG.info("Connecting to config DB for target %s", name)
+        config = ska_sdp_config.Config(**config_args)
+
+        LOG.info("Starting main loop for target %s", name)
+        self._watchdog.start()
+        self._monitor.loop_started()
+        try:
+            for watcher in config.watcher(timeout=LOOP_TIMEOUT):
+                self._pass(watcher)
+        finally:
+            self._watchdog.stop()
+
+    def _pass(self, watcher):
+        """
+        Make one pass of the main loop.
 
-        LOG.info("Starting main loop")
-        for watcher in config.watcher():
+        :param watcher: config DB watcher object (Config.watcher())
 
-            # List processing blocks and deployments
-            for txn in watcher.txn():
-                pb_ids = txn.list_processing_blocks()
-                deploy_ids = txn.list_deployments()
-                LOG.info("processing block ids %s", pb_ids)
+        """
+        # List processing blocks and deployments
+        for txn in watcher.txn():
+            pb_ids = txn.list_processing_blocks()
+            deploy_ids = txn.list_deployments()
+            LOG.info("%s: processing block ids %s", self._target.name, pb_ids)
+
+        # Perform actions. The table is updated after starting the workflows,
+        # so records added for new processing blocks get their deployments.
+        self._start_new_pb_workflows(watcher, pb_ids)
+        self._update_pb_table(pb_ids, deploy_ids)
+        self._release_pbs_with_finished_dependencies(watcher, pb_ids)
+        self._fail_stuck_pbs(watcher)
+        self._delete_timed_out_pb_deployments(watcher)
+        self._delete_deployments_without_pb(watcher, pb_ids, deploy_ids)
+
+        self._monitor.pass_completed()
+        self.metrics["passes"] += 1
+        LOG.debug("%s: metrics %s", self._target.name, self.metrics)
+
+
+def run_targets(targets, backend=None):
+    """
+    Run the processing controllers for several targets in one process.
 
-            # Perform actions.
-            self._start_new_pb_workflows(watcher, pb_ids)
-            self._release_pbs_with_finished_dependencies(watcher, pb_ids)
-            self._delete_deployments_without_pb(watcher, pb_ids, deploy_ids)
+    Each target has its own controller, running its main loop in a separate
+    thread, so a target whose config DB hangs does not hold up the others.
+    The controllers share a watchdog.
+
+    If the main loop of any target fails, its target would no longer be
+    reconciled, so the process exits with an error to be restarted.
+
+    :param targets: list of config DB targets
+    :param backend: config DB backend, overrides the target backends
+
+    """
+    watchdog = Watchdog()
+    # Receives (target name, exception or None) when a main loop exits
+    exited = queue.Queue()
+
+    def run(proccontrol, name):
+        try:
+            proccontrol.main_loop(backend=backend)
+        except Exception as err:  # pylint: disable=broad-except
+            LOG.exception("Main loop for target %s failed", name)
+            exited.put((name, err))
+        else:
+            exited.put((name, None))
+
+    for target in targets:
+        proccontrol = ProcessingController(target, watchdog=watchdog)
+        thread = threading.Thread(
+            target=run,
+            args=(proccontrol, target.name),
+            name="proccontrol-{}".format(target.name),
+            daemon=True,
+        )
+        thread.start()
+
+    for _ in targets:
+        name, err = exited.get()
+        if err is not None:
+            LOG.error("Exiting since target %s is no longer reconciled", name)
+            sys.exit(1)
 
 
 def terminate(_signame, _frame):
@@ -217,8 +455,13 @@ def main(backend=None):
     # Register SIGTERM handler
     signal.signal(signal.SIGTERM, terminate)
 
+    targets = load_targets()
+    if len(targets) > 1:
+        run_targets(targets, backend=backend)
+        return
+
     # Initialise processing controller
-    proccontrol = ProcessingController()
+    proccontrol = ProcessingController(targets[0])
 
     # Enter main loop
     proccontrol.main_loop(backend=backend)
@@ -0,0 +1,111 @@
+"""
+Configuration DB targets reconciled by the processing controller.
+"""
+import json
+import os
+
+# JSON list of targets, if not set a single target is configured from the
+# SDP_CONFIG_BACKEND, SDP_CONFIG_HOST and SDP_HELM_NAMESPACE variables
+TARGETS = os.getenv("SDP_PROCCONTROL_TARGETS")
+
+
+class Target:
+    """
+    Configuration DB target.
+
+    A target is an independent SDP instance: a config DB, the prefix of its
+    keys and the namespace in which its workflows are deployed. Values which
+    are None are taken from the environment.
+
+    Workflows cannot yet be told to use a prefix, so the workflows of a
+    target with a prefix would not find their processing blocks. The prefix
+    is therefore rejected by :func:`load_targets`.
+
+    :param name: name of the target, used in log messages
+    :param backend: config DB backend
+    :param config_host: config DB host
+    :param prefix: prefix of the keys in the config DB
+    :param namespace: Helm namespace for workflow deployments
+
+    """
+
+    # pylint: disable=too-few-public-methods, too-many-arguments
+
+    def __init__(
+        self, name="default", backend=None, config_host=None, prefix="", namespace=None
+    ):
+        self.name = name
+        self.backend = backend
+        self.config_host = config_host
+        self.prefix = prefix
+        self.namespace = namespace
+
+    def __repr__(self):
+        return "Target({!r}, backend={!r}, prefix={!r}, namespace={!r})".format(
+            self.name, self.backend, self.prefix, self.namespace
+        )
+
+    def config_args(self):
+        """
+        Get the arguments to connect to the config DB.
+
+        :returns: keyword arguments for ska_sdp_config.Config
+
+        """
+        args = {"backend": self.backend}
+        if self.config_host is not None:
+            args["host"] = self.config_host
+        if self.prefix:
+            args["global_prefix"] = self.prefix
+        return args
+
+    def workflow_env(self):
+        """
+        Get the environment variables passed to workflow deployments.
+
+        The workflow must connect to the same config DB as the target, so the
+        backend is passed as SDP_CONFIG_BACKEND if it is set for the target.
+
+        :returns: dict of environment variables
+
+        """
+        env = {}
+        env["SDP_CONFIG_HOST"] = self.config_host
+        env["SDP_HELM_NAMESPACE"] = self.namespace
+        for name, value in env.items():
+            if value is None:
+                env[name] = os.environ[name]
+        if self.backend is not None:
+            env["SDP_CONFIG_BACKEND"] = self.backend
+        return env
+
+
+def load_targets(spec=TARGETS):
+    """
+    Load the targets from a JSON specification.
+
+    The specification is a list of objects whose keys are the arguments of
+    :class:`Target`, except for the prefix, which is not yet supported by
+    workflows. For example::
+
+        [
+            {"name": "sub1", "config_host": "etcd-sub1", "namespace": "sdp-sub1"},
+            {"name": "sub2", "config_host": "etcd-sub2", "namespace": "sdp-sub2"}
+        ]
+
+    :param spec: JSON specification, if None a single default target is used
+    :returns: list of targets
+
+    """
+    if spec is None:
+        return [Target()]
+
+    targets = []
+    for args in json.loads(spec):
+        if args.get("prefix"):
+            raise ValueError("Target prefix is not supported by workflows")
+        targets.append(Target(**args))
+    names = [target.name for target in targets]
+    if not targets or len(set(names)) != len(names):
+        raise ValueError("Targets must be non-empty with unique names")
+    return targets
@@ -0,0 +1,251 @@
+"""
+Watchdog to detect stalls in the processing controller main loop.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+LOG = logging.getLogger(__name__)
+
+# Maximum time (in seconds) allowed between completed passes of the main loop
+STALL_TIMEOUT = float(os.getenv("SDP_PROCCONTROL_STALL_TIMEOUT", "300"))
+
+# Interval (in seconds) between watchdog checks
+CHECK_INTERVAL = float(os.getenv("SDP_PROCCONTROL_WATCHDOG_INTERVAL", "10"))
+
+# Files used for Kubernetes liveness and readiness probes
+LIVENESS_FILE = os.getenv("SDP_PROCCONTROL_LIVENESS_FILE")
+READINESS_FILE = os.getenv("SDP_PROCCONTROL_READINESS_FILE")
+
+
+class LoopMonitor:
+    """
+    Progress of a main loop, checked by the watchdog.
+
+    :param name: name of the loop, used in log messages
+    :param clock: function returning the current time in seconds
+
+    """
+
+    def __init__(self, name, clock=time.monotonic):
+        self.name = name
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._last_pass = clock()
+        self._thread_id = None
+        self._ready = False
+        # Used by the watchdog to only report changes in health
+        self.stalled = False
+
+    @property
+    def ready(self):
+        """True once a pass of the loop has been completed."""
+        with self._lock:
+            return self._ready
+
+    def loop_started(self):
+        """
+        Record that the loop has started.
+
+        This must be called from the thread running the loop, since that is
+        the thread whose stack is dumped when a stall is detected.
+
+        """
+        with self._lock:
+            self._last_pass = self._clock()
+            self._thread_id = threading.get_ident()
+
+    def pass_completed(self):
+        """Record that a pass of the loop has been completed."""
+        with self._lock:
+            self._last_pass = self._clock()
+            self._ready = True
+
+    def loop_lag(self):
+        """
+        Get the time since the last completed pass of the loop.
+
+        :returns: time in seconds
+
+        """
+        with self._lock:
+            return self._clock() - self._last_pass
+
+    def loop_stack(self):
+        """Format the current stack of the loop thread."""
+        # pylint: disable=protected-access
+        frame = sys._current_frames().get(self._thread_id)
+        if frame is None:
+            return "(loop thread not running)"
+        return "".join(traceback.format_stack(frame))
+
+
+class Watchdog:
+    """
+    Watchdog for the processing controller main loops.
+
+    The watchdog runs in a separate thread. For each main loop it tracks the
+    time since the last completed pass, using a :class:`LoopMonitor` obtained
+    from :meth:`monitor`. If it exceeds the threshold for any loop, the stack
+    of the loop thread is logged and the liveness file is removed, so that a
+    Kubernetes liveness probe checking for it will restart the controller.
+
+    New processing blocks are started in the same pass in which they are
+    listed, so a processing block waiting to be started always means a pass
+    which has not completed: the loop lag is the only signal needed.
+
+    :param stall_timeout: maximum time between completed passes
+    :param interval: interval between checks
+    :param liveness_file: path of liveness file, None to disable
+    :param readiness_file: path of readiness file, None to disable
+    :param clock: function returning the current time in seconds
+
+    """
+
+    # pylint: disable=too-many-arguments, too-many-instance-attributes
+
+    def __init__(
+        self,
+        stall_timeout=STALL_TIMEOUT,
+        interval=CHECK_INTERVAL,
+        liveness_file=LIVENESS_FILE,
+        readiness_file=READINESS_FILE,
+        clock=time.monotonic,
+    ):
+        self._stall_timeout = stall_timeout
+        self._interval = interval
+        self._liveness_file = liveness_file
+        self._readiness_file = readiness_file
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._monitors = []
+        # Number of running loops; the thread runs while this is non-zero
+        self._running = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def monitor(self, name="default"):
+        """
+        Create a monitor for a main loop.
+
+        :param name: name of the loop, used in log messages
+        :returns: loop monitor
+
+        """
+        monitor = LoopMonitor(name, clock=self._clock)
+        with self._lock:
+            self._monitors.append(monitor)
+        return monitor
+
+    def start(self):
+        """
+        Start the watchdog thread, if it is not already running.
+
+        Each call must be matched by a call to :meth:`stop`.
+
+        """
+        with self._lock:
+            self._running += 1
+            if self._running > 1:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="watchdog", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stop the watchdog thread and remove the probe files when the last
+        loop using it has stopped.
+        """
+        with self._lock:
+            self._running -= 1
+            if self._running > 0:
+                return
+            thread = self._thread
+            self._thread = None
+        self._stop.set()
+        if thread is not None:
+            thread.join()
+        self._remove_file(self._liveness_file)
+        self._remove_file(self._readiness_file)
+
+    def check(self):
+        """
+        Check if the main loops are healthy and update the probe files.
+
+        :returns: True if healthy, False if a stall has been detected
+
+        """
+        with self._lock:
+            monitors = list(self._monitors)
+
+        healthy = True
+        for monitor in monitors:
+            healthy &= self._check_monitor(monitor)
+
+        if healthy:
+            self._touch_file(self._liveness_file)
+        else:
+            self._remove_file(self._liveness_file)
+        if monitors and all(monitor.ready for monitor in monitors):
+            self._touch_file(self._readiness_file)
+
+        return healthy
+
+    def _check_monitor(self, monitor):
+        """
+        Check if a main loop is healthy.
+
+        :param monitor: loop monitor
+        :returns: True if healthy
+
+        """
+        lag = monitor.loop_lag()
+
+        healthy = lag <= self._stall_timeout
+        if not healthy and not monitor.stalled:
+            # Only report on entering the stalled state to avoid flooding the log
+            LOG.error(
+                "Main loop %s stalled: no pass completed for %.0f s", monitor.name, lag
+            )
+            LOG.error("Main loop %s stack:\n%s", monitor.name, monitor.loop_stack())
+        elif healthy and monitor.stalled:
+            LOG.info("Main loop %s recovered", monitor.name)
+        monitor.stalled = not healthy
+
+        return healthy
+
+    def _run(self):
+        """Watchdog thread: check the main loops periodically."""
+        while not self._stop.wait(self._interval):
+            self.check()
+
+    @staticmethod
+    def _touch_file(path):
+        """Create file or update its modification time."""
+        if path is None:
+            return
+        try:
+            with open(path, "a"):
+                pass
+            os.utime(path)
+        except OSError as err:
+            LOG.warning("Unable to update probe file %s: %s", path, err)
+
+    @staticmethod
+    def _remove_file(path):
+        """Remove file if it exists."""
+        if path is None:
+            return
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as err:
+            LOG.warning("Unable to remove probe file %s: %s", path, err)
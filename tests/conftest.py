@@ -1,3 +1,20 @@
+import pytest
 from ska_ser_logging import configure_logging
 
 configure_logging()
+
+
+class FakeClock:
+    """Clock which only advances when told to."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    """Fixture to create a fake clock, advanced by setting its 'now' attribute."""
+    return FakeClock()
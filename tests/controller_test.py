@@ -7,6 +7,8 @@ import pytest
 import ska_sdp_config
 
 from ska_sdp_proccontrol import processing_controller
+from ska_sdp_proccontrol.deadlines import DeadlineTracker
+from ska_sdp_proccontrol.target import Target
 
 LOG = logging.getLogger(__name__)
 
@@ -24,20 +26,8 @@ WORKFLOW_VERSION = "0.2.1"
 WORKFLOW_IMAGE = "testregistry/workflow-test-batch:0.2.1"
 
 
-@pytest.fixture
-@patch.dict(os.environ, MOCK_ENV_VARS)
-def config_and_controller_fixture():
-    """
-    Fixture to create config and processing controller objects with a workflow
-    definition and processing block in the config DB.
-    """
-    config = ska_sdp_config.Config()
-    controller = processing_controller.ProcessingController()
-
-    # Workflow definition
-    workflow = {"image": WORKFLOW_IMAGE}
-
-    # Processing block
+def create_workflow_and_pb(config):
+    """Create the workflow definition and processing block in the config DB."""
     pb = ska_sdp_config.ProcessingBlock(
         id=PROCESSING_BLOCK_ID,
         sbi_id="test",
@@ -49,11 +39,24 @@ def config_and_controller_fixture():
         parameters={},
         dependencies=[],
     )
-
     for txn in config.txn():
-        txn.create_workflow(WORKFLOW_TYPE, WORKFLOW_ID, WORKFLOW_VERSION, workflow)
+        txn.create_workflow(
+            WORKFLOW_TYPE, WORKFLOW_ID, WORKFLOW_VERSION, {"image": WORKFLOW_IMAGE}
+        )
         txn.create_processing_block(pb)
 
+
+@pytest.fixture
+@patch.dict(os.environ, MOCK_ENV_VARS)
+def config_and_controller_fixture():
+    """
+    Fixture to create config and processing controller objects with a workflow
+    definition and processing block in the config DB.
+    """
+    config = ska_sdp_config.Config()
+    controller = processing_controller.ProcessingController()
+    create_workflow_and_pb(config)
+
     return config, controller
 
 
@@ -193,3 +196,248 @@ def test_delete_deployments_without_pb(config_and_controller_fixture):
         assert len(txn.list_deployments()) == 0
 
     clear_config(config)
+
+
+@patch.dict(os.environ, MOCK_ENV_VARS)
+def test_controller_target_namespace(config_and_controller_fixture):
+    """
+    The workflow deployment uses the Helm namespace of the controller's target.
+    """
+    config, _ = config_and_controller_fixture
+    target = Target(name="sub1", namespace="sdp-sub1")
+    controller = processing_controller.ProcessingController(target)
+
+    controller.main_loop()
+
+    for txn in config.txn():
+        deployment = txn.get_deployment(DEPLOYMENT_ID)
+        env = deployment.args["values"]["env"]
+        assert env["SDP_HELM_NAMESPACE"] == "sdp-sub1"
+        assert env["SDP_CONFIG_HOST"] == MOCK_ENV_VARS["SDP_CONFIG_HOST"]
+    assert controller.metrics["passes"] == 1
+    assert controller.metrics["workflows_started"] == 1
+
+    clear_config(config)
+
+
+@patch.dict(os.environ, MOCK_ENV_VARS)
+def test_run_targets():
+    """
+    run_targets reconciles two targets using different prefixes in the same
+    config DB side by side, and each workflow is deployed in the namespace of
+    its target.
+    """
+    prefixes = ["/sub1", "/sub2"]
+    targets = [
+        Target(name=prefix[1:], backend="memory", prefix=prefix, namespace=prefix[1:])
+        for prefix in prefixes
+    ]
+    for prefix in prefixes:
+        create_workflow_and_pb(ska_sdp_config.Config(global_prefix=prefix))
+
+    processing_controller.run_targets(targets)
+
+    for prefix in prefixes:
+        config = ska_sdp_config.Config(global_prefix=prefix)
+        for txn in config.txn():
+            deployment = txn.get_deployment(DEPLOYMENT_ID)
+        values = deployment.args["values"]
+        env = values["env"]
+        assert env["SDP_HELM_NAMESPACE"] == prefix[1:]
+        assert env["SDP_CONFIG_BACKEND"] == "memory"
+        for txn in config.txn():
+            state = txn.get_processing_block_state(values["pb_id"])
+        assert state["status"] == "STARTING"
+
+        for path in ["/workflow", "/pb", "/deploy"]:
+            config.backend.delete(prefix + path, must_exist=False, recursive=True)
+
+    # Nothing is created without a prefix
+    for txn in ska_sdp_config.Config().txn():
+        assert txn.get_processing_block(PROCESSING_BLOCK_ID) is None
+
+
+@patch("ska_sdp_proccontrol.processing_controller.ProcessingController.main_loop")
+def test_run_targets_failure(mock_main_loop):
+    """
+    run_targets exits the process if the main loop of a target fails.
+    """
+    mock_main_loop.side_effect = [None, RuntimeError("config DB failure")]
+    targets = [Target(name="sub1"), Target(name="sub2")]
+
+    with pytest.raises(SystemExit) as excinfo:
+        processing_controller.run_targets(targets)
+    assert excinfo.value.code == 1
+
+
+@patch.dict(os.environ, MOCK_ENV_VARS)
+def test_fail_stuck_pbs(config_and_controller_fixture):
+    """
+    ProcessingController._fail_stuck_pbs sets processing blocks which stay in
+    STARTING status past their deadline to FAILED, and their deployments are
+    deleted by ProcessingController._delete_timed_out_pb_deployments.
+    """
+    config, controller = config_and_controller_fixture
+    controller._deadlines = DeadlineTracker(default_timeout=0, timeouts={})
+
+    processing_block_ids = [PROCESSING_BLOCK_ID]
+    for watcher in config.watcher():
+        controller._start_new_pb_workflows(watcher, processing_block_ids)
+        controller._update_pb_table(processing_block_ids, [DEPLOYMENT_ID])
+
+        controller._fail_stuck_pbs(watcher)
+        controller._delete_timed_out_pb_deployments(watcher)
+
+    for txn in config.txn():
+        state = txn.get_processing_block_state(PROCESSING_BLOCK_ID)
+        assert state["status"] == "FAILED"
+        assert state["reason"] == "Timed out in STARTING status"
+        assert txn.get_deployment(DEPLOYMENT_ID) is None
+    assert controller.metrics["pbs_timed_out"] == 1
+    assert controller.metrics["deployments_deleted"] == 1
+
+    clear_config(config)
+
+
+class TxnSpy:
+    """Transaction wrapper which records the processing blocks read."""
+
+    def __init__(self, txn, reads):
+        self._txn = txn
+        self._reads = reads
+
+    def __getattr__(self, name):
+        method = getattr(self._txn, name)
+        if name not in ("get_processing_block", "get_processing_block_state"):
+            return method
+
+        def spy(pb_id):
+            self._reads.append((name, pb_id))
+            return method(pb_id)
+
+        return spy
+
+
+class WatcherSpy:
+    """Watcher wrapper whose transactions record the processing blocks read."""
+
+    def __init__(self, watcher):
+        self._watcher = watcher
+        self.reads = []
+
+    def txn(self):
+        for txn in self._watcher.txn():
+            yield TxnSpy(txn, self.reads)
+
+
+@patch.dict(os.environ, MOCK_ENV_VARS)
+def test_terminal_pbs_not_read(config_and_controller_fixture):
+    """
+    Once a processing block is known to be in a terminal state, the
+    controller does not read it from the config DB again.
+    """
+    config, controller = config_and_controller_fixture
+
+    processing_block_ids = [PROCESSING_BLOCK_ID]
+    for watcher in config.watcher():
+        controller._start_new_pb_workflows(watcher, processing_block_ids)
+
+    new_state = {"resources_available": True, "status": "FINISHED"}
+    for txn in config.txn():
+        txn.update_processing_block_state(PROCESSING_BLOCK_ID, new_state)
+
+    for watcher in config.watcher():
+        # The first pass reads the terminal state into the table
+        spy = WatcherSpy(watcher)
+        controller._start_new_pb_workflows(spy, processing_block_ids)
+        controller._release_pbs_with_finished_dependencies(spy, processing_block_ids)
+        assert spy.reads
+
+        # Subsequent passes do not read it again
+        spy = WatcherSpy(watcher)
+        controller._start_new_pb_workflows(spy, processing_block_ids)
+        controller._release_pbs_with_finished_dependencies(spy, processing_block_ids)
+        assert spy.reads == []
+
+    clear_config(config)
+
+
+@patch.dict(os.environ, MOCK_ENV_VARS)
+def test_delete_timed_out_pb_deployments_after_restart(config_and_controller_fixture):
+    """
+    ProcessingController._delete_timed_out_pb_deployments finds the processing
+    blocks which timed out from the reason in their state, so their
+    deployments are deleted by a new controller after a restart, at most
+    DELETE_BATCH in each pass.
+    """
+    config, controller = config_and_controller_fixture
+    extra_deploy_id = f"proc-{PROCESSING_BLOCK_ID}-engine"
+
+    processing_block_ids = [PROCESSING_BLOCK_ID]
+    for watcher in config.watcher():
+        controller._start_new_pb_workflows(watcher, processing_block_ids)
+
+    for txn in config.txn():
+        txn.create_deployment(
+            ska_sdp_config.Deployment(extra_deploy_id, "helm", {"chart": "engine"})
+        )
+        state = txn.get_processing_block_state(PROCESSING_BLOCK_ID)
+        state["status"] = "FAILED"
+        state["reason"] = "Timed out in STARTING status"
+        txn.update_processing_block_state(PROCESSING_BLOCK_ID, state)
+
+    # New controller, as after a restart
+    controller = processing_controller.ProcessingController()
+    deploy_ids = [DEPLOYMENT_ID, extra_deploy_id]
+    with patch.object(processing_controller, "DELETE_BATCH", 1):
+        for watcher in config.watcher():
+            controller._start_new_pb_workflows(watcher, processing_block_ids)
+            controller._update_pb_table(processing_block_ids, deploy_ids)
+
+            controller._delete_timed_out_pb_deployments(watcher)
+            assert controller.metrics["deployments_deleted"] == 1
+
+            controller._update_pb_table(processing_block_ids, [extra_deploy_id])
+            controller._delete_timed_out_pb_deployments(watcher)
+            assert controller.metrics["deployments_deleted"] == 2
+
+            # Dropped once it has no deployments left
+            controller._update_pb_table(processing_block_ids, [])
+            controller._delete_timed_out_pb_deployments(watcher)
+            assert not controller._cleanup_pb_ids
+
+    for txn in config.txn():
+        assert txn.get_deployment(DEPLOYMENT_ID) is None
+        assert txn.get_deployment(extra_deploy_id) is None
+
+    clear_config(config)
+
+
+@patch.dict(os.environ, MOCK_ENV_VARS)
+def test_failed_pb_deployments_not_deleted(config_and_controller_fixture):
+    """
+    ProcessingController._delete_timed_out_pb_deployments does not delete the
+    deployments of processing blocks failed by their workflow.
+    """
+    config, controller = config_and_controller_fixture
+
+    processing_block_ids = [PROCESSING_BLOCK_ID]
+    for watcher in config.watcher():
+        controller._start_new_pb_workflows(watcher, processing_block_ids)
+
+    for txn in config.txn():
+        state = txn.get_processing_block_state(PROCESSING_BLOCK_ID)
+        state["status"] = "FAILED"
+        state["reason"] = "Workflow error"
+        txn.update_processing_block_state(PROCESSING_BLOCK_ID, state)
+
+    for watcher in config.watcher():
+        controller._start_new_pb_workflows(watcher, processing_block_ids)
+        controller._update_pb_table(processing_block_ids, [DEPLOYMENT_ID])
+        controller._delete_timed_out_pb_deployments(watcher)
+
+    for txn in config.txn():
+        assert txn.get_deployment(DEPLOYMENT_ID) is not None
+    assert controller.metrics["deployments_deleted"] == 0
+
+    clear_config(config)
@@ -0,0 +1,66 @@
+from ska_sdp_proccontrol.deadlines import DeadlineTracker
+
+PB_ID = "pb-test-20210118-00000"
+PB_ID2 = "pb-test-20210118-00001"
+
+
+def test_deadline_tracker_timeouts():
+    """
+    DeadlineTracker uses the timeout of the workflow type, or the default.
+    """
+    tracker = DeadlineTracker(default_timeout=60, timeouts={"batch": 120})
+    assert tracker.timeout("batch") == 120
+    assert tracker.timeout("realtime") == 60
+
+
+def test_deadline_tracker_expired(clock):
+    """
+    DeadlineTracker returns processing blocks which stay in a transient status
+    past their deadline, in order of deadline.
+    """
+    tracker = DeadlineTracker(default_timeout=60, timeouts={"batch": 120}, clock=clock)
+    tracker.update(PB_ID, "STARTING", "batch")
+    tracker.update(PB_ID2, "STARTING", "realtime")
+    assert len(tracker) == 2
+
+    clock.now += 59
+    # Seeing the same status again does not move the deadline
+    tracker.update(PB_ID2, "STARTING", "realtime")
+    assert tracker.expired() == []
+
+    clock.now += 1
+    assert tracker.expired() == [(PB_ID2, "STARTING")]
+    assert PB_ID2 not in tracker
+
+    clock.now += 60
+    assert tracker.expired() == [(PB_ID, "STARTING")]
+    assert len(tracker) == 0
+
+
+def test_deadline_tracker_leave_transient_status(clock):
+    """
+    DeadlineTracker stops tracking processing blocks which leave the
+    transient status.
+    """
+    tracker = DeadlineTracker(default_timeout=60, timeouts={}, clock=clock)
+    tracker.update(PB_ID, "STARTING", "batch")
+    tracker.update(PB_ID, "WAITING", "batch")
+    assert PB_ID not in tracker
+
+    tracker.update(PB_ID2, "STARTING", "batch")
+    tracker.discard(PB_ID2)
+
+    clock.now += 60
+    assert tracker.expired() == []
+
+
+def test_deadline_tracker_compact(clock):
+    """
+    DeadlineTracker does not keep growing its heap when processing blocks
+    repeatedly enter and leave the transient status.
+    """
+    tracker = DeadlineTracker(default_timeout=60, timeouts={}, clock=clock)
+    for _ in range(1000):
+        tracker.update(PB_ID, "STARTING", "batch")
+        tracker.discard(PB_ID)
+    assert len(tracker._heap) < 100
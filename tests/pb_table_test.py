@@ -0,0 +1,107 @@
+import gc
+import sys
+import tracemalloc
+
+from ska_sdp_proccontrol.pb_table import PBTable
+
+PB_ID = "pb-test-20210118-00000"
+DEP_ID = "pb-test-20210118-00001"
+
+# Number of processing blocks in the memory benchmark
+N_PBS = 100_000
+
+# Upper limit on memory per processing block in the table (bytes)
+MAX_BYTES_PER_PB = 512
+
+
+def test_pb_table_update_in_place():
+    """
+    PBTable updates the record of a processing block in place.
+    """
+    table = PBTable()
+    record = table.add(PB_ID, [DEP_ID])
+    assert record.dependencies == (DEP_ID,)
+    assert table.status(PB_ID) is None
+
+    table.update(PB_ID, {"status": "WAITING", "resources_available": False})
+    assert table.get(PB_ID) is record
+    assert record.status == "WAITING"
+    assert record.resources_available is False
+    assert not table.is_terminal(PB_ID)
+
+    table.update(PB_ID, {"status": "FINISHED", "resources_available": True})
+    assert table.get(PB_ID) is record
+    assert table.is_terminal(PB_ID)
+
+    # Adding again keeps the existing record
+    assert table.add(PB_ID) is record
+    assert len(table) == 1
+
+
+def test_pb_table_interns_ids():
+    """
+    PBTable interns the processing block and deployment IDs.
+    """
+    table = PBTable()
+    pb_id = "".join(["pb-test-", "20210118-00000"])
+    record = table.add(pb_id)
+    assert record.pb_id is PB_ID
+
+    deploy_id = "".join(["proc-", PB_ID, "-workflow"])
+    table.set_deployments(PB_ID, [deploy_id])
+    assert record.deploy_ids[0] is sys.intern(f"proc-{PB_ID}-workflow")
+
+
+def test_pb_table_retain():
+    """
+    PBTable.retain drops the records of processing blocks not in the list.
+    """
+    table = PBTable()
+    table.add(PB_ID)
+    table.add(DEP_ID)
+
+    table.retain([PB_ID, "pb-test-20210118-00002"])
+    assert PB_ID in table
+    assert DEP_ID not in table
+    assert "pb-test-20210118-00002" not in table
+    assert table.get(DEP_ID) is None
+
+
+def _populate(table, pb_ids, deploy_ids):
+    """Add processing blocks to the table, each depending on the previous one."""
+    for i, pb_id in enumerate(pb_ids):
+        table.add(pb_id, [pb_ids[i - 1]])
+        table.update(pb_id, {"status": "RUNNING", "resources_available": True})
+        table.set_deployments(pb_id, [deploy_ids[i]])
+
+
+def test_pb_table_memory_100k():
+    """
+    Benchmark the memory used by a table of 100k processing blocks, and check
+    that it stays flat when all of them are replaced by new ones.
+    """
+    # Create and intern the IDs before tracing, so that only the memory held
+    # by the table itself is measured
+    old_ids = [sys.intern(f"pb-test-20210118-{i:05d}") for i in range(N_PBS)]
+    new_ids = [sys.intern(f"pb-test-20210119-{i:05d}") for i in range(N_PBS)]
+    old_deploy_ids = [sys.intern(f"proc-{pb_id}-workflow") for pb_id in old_ids]
+    new_deploy_ids = [sys.intern(f"proc-{pb_id}-workflow") for pb_id in new_ids]
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        table = PBTable()
+        _populate(table, old_ids, old_deploy_ids)
+        size, _ = tracemalloc.get_traced_memory()
+
+        # Replace all of the processing blocks, as happens over a long uptime
+        _populate(table, new_ids, new_deploy_ids)
+        table.retain(new_ids)
+        gc.collect()
+        size_after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert len(table) == N_PBS
+    assert size / N_PBS < MAX_BYTES_PER_PB
+    assert size_after < 1.1 * size
@@ -0,0 +1,77 @@
+import os
+from unittest.mock import patch
+
+import pytest
+
+from ska_sdp_proccontrol.target import Target, load_targets
+
+MOCK_ENV_VARS = {
+    "SDP_CONFIG_HOST": "localhost",
+    "SDP_HELM_NAMESPACE": "helm",
+}
+
+
+def test_load_targets_default():
+    """
+    load_targets returns a single default target if there is no specification.
+    """
+    targets = load_targets(None)
+    assert len(targets) == 1
+    assert targets[0].name == "default"
+    assert targets[0].config_args() == {"backend": None}
+
+
+def test_load_targets():
+    """
+    load_targets creates the targets from a JSON specification.
+    """
+    targets = load_targets("""[
+            {"name": "sub1", "backend": "memory"},
+            {"name": "sub2", "config_host": "etcd2", "namespace": "sdp-sub2"}
+        ]""")
+    assert [target.name for target in targets] == ["sub1", "sub2"]
+    assert targets[0].config_args() == {"backend": "memory"}
+    assert targets[1].config_args() == {"backend": None, "host": "etcd2"}
+
+
+@pytest.mark.parametrize(
+    "spec",
+    [
+        "[]",
+        '[{"name": "sub1"}, {"name": "sub1"}]',
+        '[{"name": "sub1", "prefix": "/sub1"}]',
+    ],
+)
+def test_load_targets_invalid(spec):
+    """
+    load_targets rejects an empty list, duplicate names or a prefix.
+    """
+    with pytest.raises(ValueError):
+        load_targets(spec)
+
+
+@patch.dict(os.environ, MOCK_ENV_VARS)
+def test_target_workflow_env():
+    """
+    Target.workflow_env takes the values not set in the target from the
+    environment.
+    """
+    assert Target().workflow_env() == MOCK_ENV_VARS
+    assert Target(namespace="sdp-sub1").workflow_env() == {
+        "SDP_CONFIG_HOST": "localhost",
+        "SDP_HELM_NAMESPACE": "sdp-sub1",
+    }
+
+
+@patch.dict(os.environ, MOCK_ENV_VARS)
+def test_target_workflow_env_backend():
+    """
+    Target.workflow_env passes the backend of the target, so the workflow
+    connects to the same config DB.
+    """
+    target = Target(backend="etcd3")
+    assert target.workflow_env() == {
+        "SDP_CONFIG_HOST": "localhost",
+        "SDP_HELM_NAMESPACE": "helm",
+        "SDP_CONFIG_BACKEND": "etcd3",
+    }
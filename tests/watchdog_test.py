@@ -0,0 +1,100 @@
+import os
+
+from ska_sdp_proccontrol.watchdog import Watchdog
+
+
+def make_watchdog(tmp_path, clock):
+    return Watchdog(
+        stall_timeout=60,
+        interval=1,
+        liveness_file=str(tmp_path / "alive"),
+        readiness_file=str(tmp_path / "ready"),
+        clock=clock,
+    )
+
+
+def test_watchdog_healthy(tmp_path, clock):
+    """
+    Watchdog reports healthy and creates the probe files when passes
+    complete regularly.
+    """
+    watchdog = make_watchdog(tmp_path, clock)
+    monitor = watchdog.monitor()
+
+    assert watchdog.check()
+    assert os.path.exists(tmp_path / "alive")
+    # Not ready until the first pass has completed
+    assert not os.path.exists(tmp_path / "ready")
+
+    clock.now += 50
+    monitor.pass_completed()
+    assert monitor.loop_lag() == 0
+    assert watchdog.check()
+    assert os.path.exists(tmp_path / "ready")
+
+
+def test_watchdog_loop_stall(tmp_path, clock):
+    """
+    Watchdog detects a stall when no pass is completed within the timeout,
+    and removes the liveness file until the loop recovers.
+    """
+    watchdog = make_watchdog(tmp_path, clock)
+    monitor = watchdog.monitor()
+    monitor.pass_completed()
+    assert watchdog.check()
+
+    clock.now += 61
+    assert not watchdog.check()
+    assert not os.path.exists(tmp_path / "alive")
+
+    monitor.pass_completed()
+    assert watchdog.check()
+    assert os.path.exists(tmp_path / "alive")
+
+
+def test_watchdog_start_stop(tmp_path, clock):
+    """
+    Watchdog thread starts and stops, and the probe files are removed
+    when it is stopped.
+    """
+    watchdog = make_watchdog(tmp_path, clock)
+    monitor = watchdog.monitor()
+    watchdog.start()
+    monitor.loop_started()
+    monitor.pass_completed()
+    watchdog.check()
+    assert "watchdog_test" in monitor.loop_stack()
+    watchdog.stop()
+
+    assert not os.path.exists(tmp_path / "alive")
+    assert not os.path.exists(tmp_path / "ready")
+
+
+def test_watchdog_several_loops(tmp_path, clock):
+    """
+    Watchdog is only healthy and ready if all of the loops are, and keeps
+    running until the last loop has stopped.
+    """
+    watchdog = make_watchdog(tmp_path, clock)
+    monitor1 = watchdog.monitor("loop1")
+    monitor2 = watchdog.monitor("loop2")
+
+    monitor1.pass_completed()
+    assert watchdog.check()
+    assert not os.path.exists(tmp_path / "ready")
+
+    monitor2.pass_completed()
+    assert watchdog.check()
+    assert os.path.exists(tmp_path / "ready")
+
+    clock.now += 61
+    monitor1.pass_completed()
+    assert not watchdog.check()
+    assert not os.path.exists(tmp_path / "alive")
+
+    watchdog.start()
+    watchdog.start()
+    watchdog.stop()
+    assert os.path.exists(tmp_path / "ready")
+    watchdog.stop()
+    assert not os.path.exists(tmp_path / "ready")